@@ -0,0 +1,191 @@
+"""Benchmarks for the hot paths of Matrix, Polynomial, Coefficient and MarkovChain.
+
+    python benchmarks.py                          # print results as json
+    python benchmarks.py --save-baseline base.json
+    python benchmarks.py --baseline base.json     # compare against a stored run
+
+Every case runs over a range of sizes for int, Fraction and float entries, and the
+fitted exponent of time against size is reported so scaling curves can be compared.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import timeit
+from fractions import Fraction
+
+from matrix import Matrix
+from polynomial import Polynomial
+from coefficients import Coefficient, BaseCoef
+from markov_chain import MarkovChain
+
+DTYPES = {
+    'int': lambda rng: rng.randint(1, 9),
+    'Fraction': lambda rng: Fraction(rng.randint(1, 9), rng.randint(1, 9)),
+    'float': lambda rng: rng.uniform(1, 9),
+}
+
+
+def random_matrix(n, dtype, rng):
+    """Diagonally dominant so that it is always invertible."""
+    make = DTYPES[dtype]
+    return Matrix([[make(rng) + (10*n if i == j else 0) for j in range(n)] for i in range(n)])
+
+
+def random_polynomial(degree, dtype, rng):
+    return Polynomial(*(DTYPES[dtype](rng) for _ in range(degree + 1)))
+
+
+def random_coefficient(terms, dtype, rng):
+    return Coefficient(*(BaseCoef(f'x{i}^{rng.randint(1, 3)}', DTYPES[dtype](rng)) for i in range(terms)))
+
+
+def random_chain(states, dtype, rng):
+    rows = Matrix([[rng.randint(0, 3) for _ in range(states)] for _ in range(states)])
+    for i, r in enumerate(rows):
+        r[i] += 1
+    if dtype == 'Fraction':
+        return MarkovChain.from_unscaled_to_fraction(rows)
+    return MarkovChain.from_unscaled_matrix(rows)
+
+
+def _mul_setup(n, dtype, rng):
+    a, b = random_matrix(n, dtype, rng), random_matrix(n, dtype, rng)
+    return lambda: a * b
+
+
+def _determinant_setup(n, dtype, rng):
+    a = random_matrix(n, dtype, rng)
+    return lambda: a.determinant
+
+
+def _inverse_setup(n, dtype, rng):
+    a = random_matrix(n, dtype, rng)
+    return lambda: a.inverse
+
+
+def _poly_mul_setup(degree, dtype, rng):
+    p, q = random_polynomial(degree, dtype, rng), random_polynomial(degree, dtype, rng)
+    return lambda: p * q
+
+
+def _roots_setup(degree, dtype, rng):
+    p = random_polynomial(degree, dtype, rng)
+    return lambda: p.find_rough_roots(span=10, resolution=2)
+
+
+def _coef_mul_setup(terms, dtype, rng):
+    a, b = random_coefficient(terms, dtype, rng), random_coefficient(terms, dtype, rng)
+    return lambda: a * b
+
+
+def _next_setup(states, dtype, rng):
+    mc = random_chain(states, dtype, rng)
+    return lambda: mc.next(100)
+
+
+def _prob_setup(states, dtype, rng):
+    mc = random_chain(states, dtype, rng)
+
+    def run():
+        # forget the remembered distributions so every run does the work
+        mc.forget_distributions()
+        return mc.prob(20)
+    return run
+
+
+# name: (setup, sizes, quick sizes, dtypes)
+CASES = {
+    'Matrix.__mul__': (_mul_setup, [4, 8, 16, 32], [4, 8], DTYPES),
+    'Matrix.determinant': (_determinant_setup, [3, 4, 5, 6, 7], [3, 4, 5], DTYPES),
+    # the elimination pivots through Fraction(1, p), so inverse does not take floats
+    'Matrix.inverse': (_inverse_setup, [3, 4, 5, 6], [3, 4], ['int', 'Fraction']),
+    'Polynomial.__mul__': (_poly_mul_setup, [8, 16, 32, 64], [8, 16], DTYPES),
+    'Polynomial.find_rough_roots': (_roots_setup, [2, 4, 8], [2, 4], DTYPES),
+    'Coefficient.__mul__': (_coef_mul_setup, [2, 4, 8, 16], [2, 4], DTYPES),
+    'MarkovChain.next': (_next_setup, [4, 16, 64], [4, 16], ['Fraction', 'float']),
+    'MarkovChain.prob': (_prob_setup, [4, 16, 64], [4, 16], ['Fraction', 'float']),
+}
+
+
+def measure(fn, repeat=3):
+    """Best seconds per call."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def exponent(points):
+    """Least squares slope of log(time) against log(size)."""
+    if len(points) < 2:
+        return None
+    xs = [math.log(s) for s, _ in points]
+    ys = [math.log(t) for _, t in points]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx)*(y - my) for x, y in zip(xs, ys)) / sum((x - mx)**2 for x in xs)
+
+
+def run(quick=False, only=None, seed=0):
+    results = []
+    for name, (setup, sizes, quick_sizes, dtypes) in CASES.items():
+        if only and not any(o in name for o in only):
+            continue
+        for dtype in dtypes:
+            points = []
+            for size in quick_sizes if quick else sizes:
+                fn = setup(size, dtype, random.Random(seed))
+                seconds = measure(fn)
+                points.append((size, seconds))
+                results.append({'case': name, 'dtype': dtype, 'size': size, 'seconds': seconds})
+                print(f'{name:30}{dtype:10}{size:<6}{seconds:.3e}s', file=sys.stderr)
+            results.append({'case': name, 'dtype': dtype, 'exponent': exponent(points)})
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Ratio of every timing against the baseline, flagging the ones slower than threshold."""
+    old = {(r['case'], r['dtype'], r['size']): r['seconds'] for r in baseline if 'size' in r}
+    comparison = []
+    for r in results:
+        key = (r['case'], r.get('dtype'), r.get('size'))
+        if key in old:
+            ratio = r['seconds'] / old[key]
+            comparison.append({'case': r['case'], 'dtype': r['dtype'], 'size': r['size'],
+                               'ratio': ratio, 'regression': ratio > threshold})
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='only the small sizes')
+    parser.add_argument('--only', nargs='*', help='run the cases whose name contains any of these')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the json report here instead of stdout')
+    parser.add_argument('--baseline', help='json report to compare against')
+    parser.add_argument('--save-baseline', help='also store the results as a baseline')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.quick, args.only, args.seed)
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'results': results}
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(results, json.load(f)['results'], args.threshold)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    return int(any(c['regression'] for c in report.get('comparison', [])))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,7 @@ from collections import defaultdict
 from functools import cached_property
 
 import re
+from heapq import heapify, heappush, heappop
 
 superscript = str.maketrans("-0123456789", "⁻⁰¹²³⁴⁵⁶⁷⁸⁹")
 
@@ -135,6 +136,45 @@ class Coefficient(Number):
             if b.coef == 0:
                 del self[k]
 
+    @staticmethod
+    def variables_of(entries):
+        """Sorted identifiers used by the Coefficient and BaseCoef entries."""
+        ids = set()
+        for x in entries:
+            for b in ([x] if type(x) is BaseCoef else x if type(x) is Coefficient else []):
+                ids.update(b.cts)
+        return sorted(ids)
+
+    @staticmethod
+    def to_terms(x, variables):
+        """Sparse polynomial of x, mapping packed monomials over variables to coefficients.
+        Each exponent takes EXPONENT_BITS bits with the first variable highest, so comparing
+        packed monomials is lex order and multiplying them is adding."""
+        if isinstance(x, Number) and type(x) is not Coefficient:
+            return {0: x} if x != 0 else {}
+        terms = {}
+        for b in ([x] if type(x) is BaseCoef else x):
+            if b.coef == 0:
+                continue
+            assert all(p >= 0 for p in b.cts.values()), 'only polynomial entries are supported'
+            key = 0
+            for v in variables:
+                key = key << EXPONENT_BITS | b.cts.get(v, 0)
+            terms[key] = terms.get(key, 0) + b.coef
+        return {k: c for k, c in terms.items() if c != 0}
+
+    @staticmethod
+    def from_terms(terms, variables):
+        """Inverse of to_terms, a plain number if there are no variables left."""
+        if all(k == 0 for k in terms):
+            return terms.get(0, 0)
+        mask = (1 << EXPONENT_BITS) - 1
+        bases = []
+        for k, c in terms.items():
+            powers = [k >> EXPONENT_BITS*(len(variables) - 1 - i) & mask for i in range(len(variables))]
+            bases.append(BaseCoef('*'.join(f'{v}^{p}' for v, p in zip(variables, powers) if p), c))
+        return Coefficient(*bases)
+
 
 class BaseCoef():
     def __init__(self, identifier: str, coef: Number = 1):
@@ -241,3 +281,78 @@ class BaseCoef():
 
     def __repr__(self):
         return f'_{self.coef} {self.id}'
+
+
+# bits per exponent in packed monomials, the top one is a guard bit for divisibility checks
+EXPONENT_BITS = 32
+
+
+def mul_terms(a, b):
+    ans = {}
+    get = ans.get
+    items = list(b.items())
+    for ka, ca in a.items():
+        for kb, cb in items:
+            k = ka + kb
+            ans[k] = get(k, 0) + ca*cb
+    return {k: c for k, c in ans.items() if c != 0}
+
+
+def sub_terms(a, b):
+    ans = dict(a)
+    for k, c in b.items():
+        ans[k] = ans.get(k, 0) - c
+    return {k: c for k, c in ans.items() if c != 0}
+
+
+def _div(a, b):
+    if type(a) is int and type(b) is int and a % b == 0:
+        return a // b
+    if type(a) in (int, Fraction) and type(b) in (int, Fraction):
+        return Fraction(a, b)
+    return a / b
+
+
+def _div_monomial(m, d):
+    """Packed m/d, raising ArithmeticError if d does not divide m."""
+    fields = max(m, d).bit_length() // EXPONENT_BITS + 1
+    guard = sum(1 << (EXPONENT_BITS*i + EXPONENT_BITS-1) for i in range(fields))
+    k = (m | guard) - d
+    if k & guard != guard:
+        raise ArithmeticError('division is not exact')
+    return k & ~guard
+
+
+def exact_div_terms(a, b):
+    """Divide sparse polynomials with int or Fraction coefficients that divide exactly, by lex leading terms.
+    Raises ArithmeticError if the division leaves a remainder."""
+    assert b, 'division by zero'
+    lead = max(b)
+    cl = b[lead]
+    if len(b) == 1:
+        return {_div_monomial(k, lead): _div(c, cl) for k, c in a.items()}
+    q, r = {}, dict(a)
+    heap = [-k for k in r]
+    heapify(heap)
+    while r:
+        m = -heappop(heap)
+        if m not in r:
+            continue
+        k = _div_monomial(m, lead)
+        c = _div(r.pop(m), cl)
+        q[k] = c
+        for kb, cb in b.items():
+            if kb == lead:
+                # cancels the popped leading term
+                continue
+            key = k + kb
+            if key in r:
+                v = r[key] - c*cb
+                if v == 0:
+                    del r[key]
+                else:
+                    r[key] = v
+            else:
+                r[key] = -c*cb
+                heappush(heap, -key)
+    return q
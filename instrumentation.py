@@ -0,0 +1,166 @@
+"""Opt-in counting of operations, constructions and time spent in the public methods.
+
+    with instrument() as stats:
+        Matrix([[1, 2], [3, 4]]).inverse
+    stats.summary()
+
+The classes are only patched while the context manager is active, so nothing is
+paid when instrumentation is off.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from fractions import Fraction
+from functools import cached_property, wraps
+from time import perf_counter
+
+ARITHMETIC = {'__add__', '__radd__', '__sub__', '__rsub__', '__mul__', '__rmul__',
+              '__truediv__', '__rtruediv__', '__pow__', '__neg__'}
+
+# scalar multiplications done by a call, by class and method name
+SCALAR_MULS = {
+    ('vector', 'dot'): lambda u, v: len(u),
+    ('vector', 'scale'): lambda self, s: len(self),
+    ('Matrix', 'scale'): lambda self, s: self.shape[0]*self.shape[1],
+    ('Polynomial', '__mul__'): lambda self, other: len(self.coefs)*len(getattr(other, 'coefs', [0])),
+    ('Polynomial', '__rmul__'): lambda self, other: len(self.coefs),
+}
+
+_active = False
+
+
+class Stats():
+    def __init__(self):
+        self.calls = Counter()
+        self.time = defaultdict(float)
+        self.ops = Counter()
+        self.constructions = Counter()
+        self.scalar_muls = 0
+        self.fraction_normalizations = 0
+        self.wall_time = 0
+
+    def summary(self):
+        return {
+            'wall_time': self.wall_time,
+            'scalar_muls': self.scalar_muls,
+            'fraction_normalizations': self.fraction_normalizations,
+            'constructions': dict(self.constructions.most_common()),
+            'ops': dict(self.ops.most_common()),
+            'calls': dict(self.calls.most_common()),
+            'time': dict(sorted(self.time.items(), key=lambda kv: -kv[1])),
+        }
+
+
+def _targets():
+    from matrix import Matrix, vector
+    from polynomial import Polynomial
+    from coefficients import Coefficient, BaseCoef
+    from markov_chain import MarkovChain, TransitionCounts
+    return [vector, Matrix, Polynomial, Coefficient, BaseCoef, MarkovChain, TransitionCounts]
+
+
+def _wrap(stats, cls, name, func):
+    key = f'{cls.__name__}.{name}'
+    muls = SCALAR_MULS.get((cls.__name__, name))
+    depth = 0
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal depth
+        if name == '__init__':
+            stats.constructions[cls.__name__] += 1
+        elif name in ARITHMETIC:
+            stats.ops[key] += 1
+        if muls is not None:
+            stats.scalar_muls += muls(*args, **kwargs)
+        stats.calls[key] += 1
+        if depth:
+            # recursive calls are already inside the outermost timer
+            return func(*args, **kwargs)
+        depth += 1
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.time[key] += perf_counter() - start
+            depth -= 1
+    return wrapper
+
+
+def _instrumented(stats, cls, name, attr):
+    """Instrumented replacement for the class attribute, or None if it is left alone."""
+    if name.startswith('_') and name not in ARITHMETIC and name != '__init__':
+        return None
+    if isinstance(attr, staticmethod):
+        return staticmethod(_wrap(stats, cls, name, attr.__func__))
+    if isinstance(attr, property):
+        return property(_wrap(stats, cls, name, attr.fget), attr.fset, attr.fdel, attr.__doc__)
+    if isinstance(attr, cached_property):
+        new = cached_property(_wrap(stats, cls, name, attr.func))
+        new.__set_name__(cls, name)
+        return new
+    if callable(attr) and not isinstance(attr, type):
+        return _wrap(stats, cls, name, attr)
+    return None
+
+
+def _patch_fraction(stats):
+    new, originals = Fraction.__new__, {'__new__': Fraction.__dict__['__new__']}
+    depth = 0
+
+    def counted_new(cls, *args, **kwargs):
+        # arithmetic results are counted by the op wrappers, whichever way the python version builds them
+        if depth or kwargs.get('_normalize') is False:
+            return new(cls, *args, **kwargs)
+        stats.constructions['Fraction'] += 1
+        # a numerator and denominator pair is reduced by their gcd
+        if len(args) > 1 or kwargs.get('denominator') is not None:
+            stats.fraction_normalizations += 1
+        return new(cls, *args, **kwargs)
+
+    def counted(name, op):
+        @wraps(op)
+        def wrapper(a, b):
+            nonlocal depth
+            stats.ops[f'Fraction.{name}'] += 1
+            depth += 1
+            try:
+                ans = op(a, b)
+            finally:
+                depth -= 1
+            if type(ans) is Fraction:
+                stats.constructions['Fraction'] += 1
+            return ans
+        return wrapper
+
+    for name in ARITHMETIC - {'__neg__'}:
+        originals[name] = Fraction.__dict__[name]
+        setattr(Fraction, name, counted(name, originals[name]))
+    Fraction.__new__ = counted_new
+    return originals
+
+
+@contextmanager
+def instrument():
+    """Count operations, constructions and time per public method while active."""
+    global _active
+    assert not _active, 'instrumentation is already active'
+    stats = Stats()
+    patched = []
+    for cls in _targets():
+        for name, attr in list(cls.__dict__.items()):
+            new = _instrumented(stats, cls, name, attr)
+            if new is not None:
+                patched.append((cls, name, attr))
+                setattr(cls, name, new)
+    fraction = _patch_fraction(stats)
+    _active = True
+    start = perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.wall_time = perf_counter() - start
+        for name, attr in fraction.items():
+            setattr(Fraction, name, attr)
+        for cls, name, attr in patched:
+            setattr(cls, name, attr)
+        _active = False
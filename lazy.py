@@ -0,0 +1,202 @@
+"""Lazy matrix expressions.
+
+    A = Matrix(...).lazy
+    x = ((A.T*A)**-1 * A.T*b).evaluate()
+
+T, *, **, |, / and scaling by a number build an expression tree instead of computing.
+evaluate() first optimizes the tree: transposes are pushed down to the leaves and
+folded, nested products are flattened into chains that are multiplied in the cheapest
+order, inverse * x becomes a linear solve and repeated subexpressions are computed once.
+"""
+from numbers import Number
+
+from matrix import Matrix, vector
+
+
+class Expr():
+    def __init__(self, op, args=(), param=None):
+        self.op = op
+        self.args = tuple(args)
+        self.param = param
+        if op == 'leaf':
+            self.key = ('leaf', id(param))
+        else:
+            self.key = (op, param) + tuple(a.key for a in self.args)
+
+    def __repr__(self):
+        if self.op == 'leaf':
+            return f'{type(self.param).__name__}{self.shape}'
+        a = self.args
+        if self.op == 'T':
+            return f'{a[0]}.T'
+        if self.op == 'inv':
+            return f'({a[0]})**-1'
+        if self.op == 'pow':
+            return f'({a[0]})**{self.param}'
+        if self.op == 'scale':
+            return f'{self.param}*{a[0]}'
+        return '(' + f' {self.op} '.join(map(repr, a)) + ')'
+
+    @property
+    def shape(self):
+        a = [x.shape for x in self.args]
+        if self.op == 'leaf':
+            return self.param.shape if type(self.param) is Matrix else (len(self.param), 1)
+        if self.op == 'T':
+            return a[0][::-1]
+        if self.op == '*':
+            return a[0][0], a[-1][1]
+        if self.op == '|':
+            return a[0][0], a[0][1] + a[1][1]
+        if self.op == '/':
+            # like Matrix / vector, a vector below is stacked as a row
+            return a[0][0] + (1 if _is_vector(self.args[1]) else a[1][0]), a[0][1]
+        return a[0]
+
+    @property
+    def T(self):
+        return Expr('T', [self])
+
+    def __mul__(self, other):
+        if isinstance(other, Number):
+            return Expr('scale', [self], other)
+        other = lazy(other)
+        assert self.shape[1] == other.shape[0], "inner shape does not match"
+        return Expr('*', [self, other])
+
+    def __rmul__(self, other):
+        if isinstance(other, Number):
+            return Expr('scale', [self], other)
+        return lazy(other) * self
+
+    def __pow__(self, p):
+        if type(p) is not int:
+            return NotImplemented
+        assert self.shape[0] == self.shape[1], 'Matrix exponantiation only allowed for square matrices'
+        assert p >= -1, 'negative integers not allowed'
+        if p == -1:
+            return Expr('inv', [self])
+        return Expr('pow', [self], p)
+
+    def __or__(self, other):
+        other = lazy(other)
+        assert self.shape[0] == other.shape[0], "sizes do not match"
+        return Expr('|', [self, other])
+
+    def __truediv__(self, other):
+        other = lazy(other)
+        width = other.shape[0] if _is_vector(other) else other.shape[1]
+        assert self.shape[1] == width, "sizes do not match"
+        return Expr('/', [self, other])
+
+    def evaluate(self):
+        return _evaluate(optimize(self), {})
+
+
+def lazy(x):
+    """Wrap a Matrix or vector-like as a leaf of an expression."""
+    if type(x) is Expr:
+        return x
+    assert type(x) in (Matrix, vector, list, tuple), 'only matrices and vectors can be lazy'
+    return Expr('leaf', param=x)
+
+
+def _is_vector(node):
+    """Whether the node evaluates to a vector rather than a Matrix."""
+    if node.op == 'leaf':
+        return type(node.param) is not Matrix
+    if node.op == '*':
+        return _is_vector(node.args[-1])
+    if node.op == 'scale':
+        return _is_vector(node.args[0])
+    return False
+
+
+def optimize(node, table=None):
+    """Rewrite the tree into canonical form, sharing identical subtrees through table."""
+    table = {} if table is None else table
+    args = [optimize(a, table) for a in node.args]
+    op = node.op
+    if op == 'T':
+        x = args[0]
+        if x.op == 'T':
+            return x.args[0]
+        if x.op == '*':
+            return optimize(Expr('*', [Expr('T', [f]) for f in reversed(x.args)]), table)
+        if x.op == 'inv':
+            return optimize(Expr('inv', [Expr('T', x.args)]), table)
+        if x.op == 'scale':
+            return optimize(Expr('scale', [Expr('T', x.args)], x.param), table)
+    if op == '*':
+        args = [f for a in args for f in (a.args if a.op == '*' else [a])]
+    if op == 'pow' and node.param == 1:
+        return args[0]
+    new = Expr(op, args, node.param) if op != 'leaf' else node
+    return table.setdefault(new.key, new)
+
+
+def _evaluate(node, memo):
+    if node.key in memo:
+        return memo[node.key]
+    op = node.op
+    if op == 'leaf':
+        value = node.param if type(node.param) is Matrix else vector(node.param)
+    elif op == '*':
+        value = _chain(node.args, memo)
+    else:
+        a = [_evaluate(x, memo) for x in node.args]
+        if op == 'T':
+            value = a[0].T
+        elif op == 'inv':
+            value = a[0].solve_for(Matrix.identity(a[0].shape[0]))
+        elif op == 'pow':
+            value = a[0] ** node.param
+        elif op == 'scale':
+            value = node.param * a[0]
+        elif op == '|':
+            value = a[0] | a[1]
+        else:
+            value = a[0] / a[1]
+    memo[node.key] = value
+    return value
+
+
+def _chain(factors, memo):
+    """Multiply the factors right to left, solving instead of inverting."""
+    acc = None
+    i = len(factors)
+    while i > 0:
+        if factors[i-1].op == 'inv':
+            A = _evaluate(factors[i-1].args[0], memo)
+            acc = A.solve_for(Matrix.identity(A.shape[0]) if acc is None else acc)
+            i -= 1
+            continue
+        j = i
+        while j > 0 and factors[j-1].op != 'inv':
+            j -= 1
+        values = [_evaluate(f, memo) for f in factors[j:i]]
+        acc = _multiply_chain(values if acc is None else values + [acc])
+        i = j
+    return acc
+
+
+def _multiply_chain(values):
+    """Multiply in the order with the fewest scalar multiplications."""
+    last = len(values) - 1
+    # a vector is a column, and only stays a vector as the rightmost factor
+    values = [v if type(v) is Matrix or k == last else Matrix([[x] for x in v])
+              for k, v in enumerate(values)]
+    dims = [values[0].shape[0]] + [v.shape[1] for v in values]
+    cost, split = {(i, i): 0 for i in range(len(values))}, {}
+    for length in range(2, len(values) + 1):
+        for i in range(len(values) - length + 1):
+            j = i + length - 1
+            cost[i, j], split[i, j] = min(
+                (cost[i, k] + cost[k+1, j] + dims[i]*dims[k+1]*dims[j+1], k) for k in range(i, j))
+
+    def build(i, j):
+        if i == j:
+            return values[i]
+        k = split[i, j]
+        return build(i, k) * build(k+1, j)
+    return build(0, last)
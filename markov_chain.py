@@ -1,19 +1,31 @@
-from random import random
-from functools import reduce, lru_cache
+from random import random, Random, getrandbits
+from functools import reduce, cached_property
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from hashlib import sha256
+from fractions import Fraction
+from collections import Counter
 from matrix import Matrix, vector
 import itertools as itt
+import operator
+import os
+
+# float classes up to this size are solved directly instead of by power iteration
+DENSE_LIMIT = 100
+# the distributions of the first CACHED_STEPS timesteps are remembered, later ones only every CACHED_STEPS timesteps
+CACHED_STEPS = 1024
 
 
 class MarkovChain():
-    def __init__(self, trans_matrix: Matrix, init_prob=None):
+    def __init__(self, trans_matrix: Matrix, init_prob=None, seed=None):
         if init_prob is None:
             size = trans_matrix.shape[0]
             init_prob = [1/size for _ in range(size)]
         else:
             assert type(init_prob) in (
                 list, tuple, vector), "initial probabilities must be vector-like"
-            assert sum(
-                init_prob) == 1, "sum of initial probabilities must equal 1"
+            assert round(sum(
+                init_prob), 9) == 1, "sum of initial probabilities must equal 1"
         assert type(
             trans_matrix) is Matrix, "transition matrix must be of type matrix"
         assert trans_matrix.is_square, "transition matrix must be square"
@@ -21,6 +33,9 @@ class MarkovChain():
             r), 9) == 1 for r in trans_matrix.rows), "the rows of the transition matrix must add up to 1"
         self.P = trans_matrix
         self.p0 = init_prob
+        self.random = random if seed is None else Random(seed).random
+        self._stationary = {}
+        self.forget_distributions()
 
         self.restart()
 
@@ -33,26 +48,108 @@ class MarkovChain():
         return self.state
 
     def _pick(self, prob):
-        r = random()
+        r = self.random()
         for i, p in enumerate(itt.accumulate(prob)):
             if r < p:
                 return i
 
+    def simulate(self, walkers, steps, seed=None, workers=None):
+        """Run independent walkers for steps timesteps on a process pool.
+        Every walker draws from its own stream spawned from seed, so the result
+        only depends on seed and not on the number of workers.
+        Returns the histogram of final states and the visit counts of every state."""
+        if seed is None:
+            seed = getrandbits(64)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        tables = _cumulative_tables(self.P, self.p0)
+        n = len(self.p0)
+        size = -(-walkers // (4 * workers)) if walkers else 1
+        chunks = [range(i, min(i + size, walkers))
+                  for i in range(0, walkers, size)]
+
+        if workers == 1 or len(chunks) <= 1:
+            results = [_walk(tables, c, steps, seed) for c in chunks]
+        else:
+            # the tables are sent once per worker process, not once per chunk
+            with ProcessPoolExecutor(workers, initializer=_share_tables, initargs=(tables,)) as pool:
+                results = list(pool.map(_pool_walk, chunks,
+                                        itt.repeat(steps), itt.repeat(seed)))
+
+        final, visits = [0]*n, [0]*n
+        for f, v in results:
+            final = list(map(sum, zip(final, f)))
+            visits = list(map(sum, zip(visits, v)))
+        return vector(final), vector(visits)
+
     def probXY(self, x, y, n=1):
         """Probability of transitioning from state x to state y in n timesteps"""
+        if self._propagation_is_cheaper(n):
+            start = [0]*len(self.p0)
+            start[x] = 1
+            return self._evolve(start, n)[y]
         m = self.P ** n
         return m[x][y]
 
-
     def probX(self, x, n=1):
         """Probability of being at state x in the n-th timestep."""
         return self.prob(n)[x]
 
     def prob(self, n=1):
         """Probability of all states at timestep n."""
+        k, _ = self._nearest_distribution(n)
+        if self._propagation_is_cheaper(n - k):
+            return self._distribution(n).copy()
         m = self.P ** n
         return vector(m.T*self.p0)
 
+    def iter_distributions(self):
+        """Lazily yield the distributions of timesteps 1, 2, ..."""
+        return (self._distribution(n).copy() for n in itt.count(1))
+
+    def forget_distributions(self):
+        """Drop the remembered distributions of p0."""
+        self._distributions = {0: vector(self.p0)}
+        self._frontier = 0, self._distributions[0]
+
+    def _nearest_distribution(self, n):
+        """Latest remembered timestep not after n and its distribution."""
+        top, p = self._frontier
+        if n >= top:
+            return top, p
+        k = n if n < CACHED_STEPS else n - n % CACHED_STEPS
+        return k, self._distributions[k]
+
+    def _distribution(self, n):
+        k, p = self._nearest_distribution(n)
+        for step in range(k+1, n+1):
+            p = vector(self._step(p))
+            if step < CACHED_STEPS or step % CACHED_STEPS == 0:
+                self._distributions[step] = p
+        if n > self._frontier[0]:
+            self._frontier = n, p
+        return p
+
+    def _step(self, p):
+        """Vector-matrix product p * P over the nonzero transitions."""
+        q = [0]*len(p)
+        for pi, r in zip(p, self._sparse):
+            if pi != 0:
+                for j, a in r:
+                    q[j] += pi*a
+        return q
+
+    def _evolve(self, p, n):
+        for _ in range(n):
+            p = self._step(p)
+        return p
+
+    def _propagation_is_cheaper(self, n):
+        """Compare n sparse vector steps against squaring the full matrix."""
+        size = len(self.p0)
+        nnz = sum(map(len, self._sparse))
+        return n * nnz <= n.bit_length() * size**3
+
     def prob_Xn_eq_x_given_Xn2_eq_y(self, n, x, n2, y):
         diff = n - n2
         if diff >= 0:
@@ -82,39 +179,326 @@ class MarkovChain():
         return MarkovChain(scaled_matrix, init_prob)
 
 
-    # @cached_property
-    @property
-    @lru_cache(maxsize=1)
+    @cached_property
+    def _sparse(self):
+        """Nonzero (column, probability) pairs of every row of P."""
+        return [[(j, a) for j, a in enumerate(r) if a != 0] for r in self.P.rows]
+
+    @cached_property
+    def is_exact(self):
+        return all(type(a) in (int, Fraction) for a in itt.chain(*self.P.rows))
+
+    def stationary(self, tol=1e-12, max_iter=100_000):
+        """Solve πP = π for a chain with a single recurrent class.
+        Chains with several recurrent classes have no unique stationary vector, see stationary_by_class."""
+        ans = self.stationary_by_class(tol, max_iter)
+        if len(ans) != 1:
+            raise ValueError(f'the chain has {len(ans)} recurrent classes, use stationary_by_class')
+        return next(iter(ans.values()))
+
+    def stationary_by_class(self, tol=1e-12, max_iter=100_000):
+        """Solve πP = π on every recurrent class.
+        Returns a dict mapping each recurrent class to its stationary vector over all states.
+        Exact for Fraction chains, power iteration up to tol for large float classes."""
+        recurrent = [c for c, kind in self.classes.items() if kind == 'recurrent']
+        direct = self.is_exact or all(len(c) <= DENSE_LIMIT for c in recurrent)
+        # tol and max_iter only matter when some class goes through power iteration
+        key = None if direct else (tol, max_iter)
+        if key not in self._stationary:
+            n = len(self.p0)
+            ans = {}
+            for c in recurrent:
+                if self.is_exact or len(c) <= DENSE_LIMIT:
+                    pi = self._solve_stationary(c)
+                else:
+                    pi = self._power_stationary(c, tol, max_iter)
+                full = [0]*n
+                for i, p in zip(c, pi):
+                    full[i] = p
+                ans[c] = vector(full)
+            self._stationary[key] = ans
+        return {c: v.copy() for c, v in self._stationary[key].items()}
+
+    def _solve_stationary(self, c):
+        pos = {s: k for k, s in enumerate(c)}
+        A = [[0]*len(c) for _ in c]
+        for i in c:
+            A[pos[i]][pos[i]] -= 1
+            for j, a in self._sparse[i]:
+                A[pos[j]][pos[i]] += a
+        # one equation is redundant, replace it with the normalization
+        A[-1] = [1]*len(c)
+        b = [0]*(len(c)-1) + [1]
+        return Matrix(A).solve_for(b)
+
+    def _power_stationary(self, c, tol, max_iter):
+        pos = {s: k for k, s in enumerate(c)}
+        rows = [[(pos[j], a) for j, a in self._sparse[i]] for i in c]
+        x = [1/len(c)]*len(c)
+        for _ in range(max_iter):
+            # iterate the lazy chain (P+I)/2, it has the same stationary distribution and is aperiodic
+            y = [p/2 for p in x]
+            for i, r in enumerate(rows):
+                xi = x[i]/2
+                for j, a in r:
+                    y[j] += xi*a
+            if sum(abs(a - b) for a, b in zip(x, y)) < tol:
+                return y
+            x = y
+        raise ArithmeticError(f'power iteration did not converge in {max_iter} iterations')
+
+    @cached_property
+    def _components(self):
+        """Strongly connected components of the transition graph, found with an iterative Tarjan pass.
+        Returns the component of every state and the components in reverse topological order."""
+        n = len(self.p0)
+        index, low, comp = [None]*n, [0]*n, [None]*n
+        stack, on_stack, components = [], [False]*n, []
+        counter = 0
+        for root in range(n):
+            if index[root] is not None:
+                continue
+            work = [(root, 0)]
+            while work:
+                v, k = work.pop()
+                if k == 0:
+                    index[v] = low[v] = counter
+                    counter += 1
+                    stack.append(v)
+                    on_stack[v] = True
+                edges = self._sparse[v]
+                while k < len(edges):
+                    w = edges[k][0]
+                    k += 1
+                    if index[w] is None:
+                        work.append((v, k))
+                        work.append((w, 0))
+                        break
+                    if on_stack[w]:
+                        low[v] = min(low[v], index[w])
+                else:
+                    if low[v] == index[v]:
+                        c = []
+                        while True:
+                            w = stack.pop()
+                            on_stack[w] = False
+                            comp[w] = len(components)
+                            c.append(w)
+                            if w == v:
+                                break
+                        components.append(tuple(sorted(c)))
+                    if work:
+                        u = work[-1][0]
+                        low[u] = min(low[u], low[v])
+        return comp, components
+
+    @cached_property
+    def _reach(self):
+        """Bitset of the components reachable from every component."""
+        comp, components = self._components
+        reach = []
+        # tarjan emits components sinks first, so successors are always done
+        for c, states in enumerate(components):
+            r = 1 << c
+            for i in states:
+                for j, _ in self._sparse[i]:
+                    r |= reach[comp[j]] if comp[j] != c else 0
+            reach.append(r)
+        return reach
+
+    @cached_property
     def classes(self):
         """Calculate the communication classes of the MC."""
-        classes = {}
-        for i in range(len(self.p0)):
-            for j in range(i, len(self.p0)):
-                if self.accessible(i, j) and self.accessible(j, i):
-                    # communicating!
-                    if i in classes:
-                        classes[i].add(j)
-                    else:
-                        classes[i] = set((i, j))
-                    classes[j] = classes[i]
-        m = map(tuple, classes.values())
-        return dict((t, self._recurrent(t[0])) for t in m)
-
-    def accessible(self, i, j, tried=None):
+        comp, components = self._components
+        closed = [all(comp[j] == c for i in states for j, _ in self._sparse[i])
+                  for c, states in enumerate(components)]
+        order = sorted(range(len(components)), key=lambda c: components[c][0])
+        return dict((components[c], 'recurrent' if closed[c] else 'transitive') for c in order)
+
+    def accessible(self, i, j):
         """Indicate if i->j."""
-        if tried is None:
-            tried = set()
-        tried.add(i)
-        if i == j:
-            return True
-        access = [k for k, a in enumerate(
-            self.P[i]) if a > 0 and k not in tried]
-        for k in access:
-            if self.accessible(k, j, tried):
-                return True
-        return False
-
-    def _recurrent(self, i):
-        is_recurrent = all(self.accessible(j, i)
-                           for j, a in enumerate(self.P[i]) if a > 0)
-        return 'recurrent' if is_recurrent else 'transitive'
+        comp = self._components[0]
+        return bool(self._reach[comp[i]] >> comp[j] & 1)
+
+    @cached_property
+    def canonical_form(self):
+        """Split P into the transient block Q and the block R of transitions into each recurrent class.
+        Returns the transient states, the recurrent classes, Q and R, which are empty if there are no transient states."""
+        transient = [i for c, kind in self.classes.items() if kind != 'recurrent' for i in c]
+        recurrent = [c for c, kind in self.classes.items() if kind == 'recurrent']
+        pos = {s: k for k, s in enumerate(transient)}
+        comp = self._components[0]
+        col = {comp[c[0]]: k for k, c in enumerate(recurrent)}
+        Q = [[0]*len(transient) for _ in transient]
+        R = [[0]*len(recurrent) for _ in transient]
+        for t, i in enumerate(transient):
+            for j, a in self._sparse[i]:
+                if j in pos:
+                    Q[t][pos[j]] += a
+                else:
+                    R[t][col[comp[j]]] += a
+        return transient, recurrent, Matrix(Q), Matrix(R)
+
+    @cached_property
+    def _I_minus_Q(self):
+        Q = self.canonical_form[2]
+        return Matrix([[int(i == j) - a for j, a in enumerate(r)] for i, r in enumerate(Q)])
+
+    @cached_property
+    def absorption_probabilities(self):
+        """Probability of each transient state (rows) ending in each recurrent class (columns).
+        Solves (I-Q)B = R instead of inverting I-Q."""
+        return self._I_minus_Q.solve_for(self.canonical_form[3])
+
+    @cached_property
+    def expected_steps(self):
+        """Expected number of steps from each transient state until reaching a recurrent class."""
+        return self._I_minus_Q.solve_for([1]*len(self.canonical_form[0]))
+
+    def mean_first_passage(self, j):
+        """Expected number of steps to reach state j from every state.
+        The entry of j itself is its mean return time, and states that may never reach j get inf."""
+        n = len(self.p0)
+        comp, reach = self._components[0], self._reach
+        # j is hit almost surely from i iff every component reachable from i's reaches j's
+        hits = sum(1 << c for c, r in enumerate(reach) if r >> comp[j] & 1)
+        sure = [i for i in range(n) if not reach[comp[i]] & ~hits]
+        others = [i for i in sure if i != j]
+        ans = [float('inf')]*n
+        if others:
+            pos = {s: k for k, s in enumerate(others)}
+            A = [[0]*len(others) for _ in others]
+            for t, i in enumerate(others):
+                A[t][t] += 1
+                for k, a in self._sparse[i]:
+                    if k in pos:
+                        A[t][pos[k]] -= a
+            for i, m in zip(others, Matrix(A).solve_for([1]*len(others))):
+                ans[i] = m
+        if j in sure:
+            ans[j] = 1 + sum(a*ans[k] for k, a in self._sparse[j] if k != j)
+        return vector(ans)
+
+
+class TransitionCounts():
+    """Sparse transition counts accumulated from streams of observed states.
+    Without intern the states must be the indices 0..n-1, with intern any hashable
+    labels are mapped to indices in order of appearance."""
+
+    def __init__(self, intern=False):
+        self.counts = Counter()  # (i, j) -> number of i->j transitions
+        self.starts = Counter()
+        self.labels = [] if intern else None
+        self._index = {}
+        self._last = None
+
+    def index(self, label):
+        """Index of label, interning it if it is new."""
+        if label not in self._index:
+            self._index[label] = len(self.labels)
+            self.labels.append(label)
+        return self._index[label]
+
+    def feed(self, chunk):
+        """Count the transitions in chunk. Consecutive chunks continue the same sequence until end_sequence is called."""
+        if self.labels is None:
+            seq = [int(s) for s in chunk]
+        else:
+            seq = [self.index(s) for s in chunk]
+        if not seq:
+            return self
+        if self._last is None:
+            self.starts[seq[0]] += 1
+        else:
+            self.counts[self._last, seq[0]] += 1
+        self.counts.update(zip(seq, seq[1:]))
+        self._last = seq[-1]
+        return self
+
+    def end_sequence(self):
+        self._last = None
+        return self
+
+    def fit(self, sequences):
+        """Count every sequence of an iterable of sequences."""
+        for seq in sequences:
+            self.feed(seq).end_sequence()
+        return self
+
+    def merge(self, other):
+        """Add the counts of other, e.g. partial counts from another worker."""
+        assert (self.labels is None) == (other.labels is None), "can't merge interned with plain counts"
+        if self.labels is None:
+            self.counts.update(other.counts)
+            self.starts.update(other.starts)
+            return self
+        remap = [self.index(label) for label in other.labels]
+        for (i, j), c in other.counts.items():
+            self.counts[remap[i], remap[j]] += c
+        for i, c in other.starts.items():
+            self.starts[remap[i]] += c
+        return self
+
+    @property
+    def size(self):
+        if self.labels is not None:
+            return len(self.labels)
+        return 1 + max(itt.chain(itt.chain(*self.counts), self.starts), default=-1)
+
+    def to_chain(self, exact=True, states=None):
+        """Build a MarkovChain from the counts, with Fraction probabilities if exact.
+        States that were never left are made absorbing."""
+        n = self.size if states is None else states
+        assert n >= self.size, f'states must be at least {self.size}, the number of observed states'
+        assert n > 0, 'no states have been observed'
+        div = Fraction if exact else operator.truediv
+        totals = [0]*n
+        for (i, _), c in self.counts.items():
+            totals[i] += c
+        rows = [[div(0, 1)]*n for _ in range(n)]
+        for (i, j), c in self.counts.items():
+            rows[i][j] = div(c, totals[i])
+        for i, t in enumerate(totals):
+            if t == 0:
+                rows[i][i] = div(1, 1)
+        init = None
+        if self.starts:
+            total = sum(self.starts.values())
+            init = [div(self.starts[i], total) for i in range(n)]
+        return MarkovChain(Matrix(rows), init)
+
+
+def spawn_seed(seed, i):
+    """Derive the seed of the i-th independent stream of seed."""
+    return int.from_bytes(sha256(f'{seed}:{i}'.encode()).digest(), 'big')
+
+
+def _cumulative_tables(P, p0):
+    return [list(itt.accumulate(p0))] + [list(itt.accumulate(r)) for r in P.rows]
+
+
+def _walk(tables, walkers, steps, seed):
+    init, rows = tables[0], tables[1:]
+    n = len(init)
+    final, visits = [0]*n, [0]*n
+    for w in walkers:
+        r = Random(spawn_seed(seed, w)).random
+        state = min(bisect_right(init, r()), n-1)
+        visits[state] += 1
+        for _ in range(steps):
+            state = min(bisect_right(rows[state], r()), n-1)
+            visits[state] += 1
+        final[state] += 1
+    return final, visits
+
+
+_shared_tables = None
+
+
+def _share_tables(tables):
+    global _shared_tables
+    _shared_tables = tables
+
+
+def _pool_walk(walkers, steps, seed):
+    return _walk(_shared_tables, walkers, steps, seed)
@@ -1,9 +1,13 @@
 from functools import reduce, lru_cache, cached_property
 import operator
+import math
 import itertools as itt
 from fractions import Fraction
 from numbers import Number
 
+# float entries smaller than this times the largest absolute entry count as 0 in row_reduce
+FLOAT_TOL = 1e-12
+
 
 class vector():
     def __init__(self, iterable):
@@ -118,6 +122,8 @@ class Matrix():
 
     # @cached_property
     def __repr__(self):
+        if not self.m:
+            return ''
         if type(self.m[0][0]) is float:
             return '\n'.join(''.join(str(round(a, 3)).ljust(6) for a in r) for r in self.m).strip()
 
@@ -184,7 +190,14 @@ class Matrix():
             return self.inverse
         if p == 0:
             return Matrix.identity(self.shape[0])
-        return reduce(operator.mul, (itt.repeat(self, p)))
+        ans, square = None, self
+        while p:
+            if p & 1:
+                ans = square if ans is None else ans * square
+            p >>= 1
+            if p:
+                square = square * square
+        return ans
 
     def scale(self, scalar):
         return Matrix([list(map(lambda x: x*scalar, r)) for r in self.rows])
@@ -195,7 +208,7 @@ class Matrix():
     # @cached_property  # requires python 3.8
     @property
     def shape(self):
-        return len(self.m), len(self.m[0])
+        return len(self.m), len(self.m[0]) if self.m else 0
 
     @property
     def is_square(self):
@@ -234,11 +247,88 @@ class Matrix():
     @property
     def determinant(self):
         assert self.is_square, "determinant is only defined for square matrices"
+        if self.is_symbolic:
+            return self._symbolic_determinant
+        return self._cofactor_determinant()
+
+    def _cofactor_determinant(self):
         s = self.shape[0]
         if s == 2:
             return self.m[0][0]*self.m[1][1] - self.m[0][1]*self.m[1][0]
 
-        return sum((-1)**j*self.m[0][j]*self.get_minor_for(0, j).determinant for j in range(s) if self.m[0][j] != 0)
+        return sum((-1)**j*self.m[0][j]*self.get_minor_for(0, j)._cofactor_determinant() for j in range(s) if self.m[0][j] != 0)
+
+    @property
+    def is_symbolic(self):
+        from coefficients import Coefficient, BaseCoef
+        return any(type(a) in (Coefficient, BaseCoef) for a in itt.chain(*self.m))
+
+    def _bareiss(self, adjugate):
+        """Determinant, and adjugate if asked for, of a symbolic matrix by fraction-free
+        (Bareiss) elimination over the polynomial ring of its Coefficient entries.
+        Every intermediate entry is a minor, computed once and divided exactly by the previous pivot.
+        The adjugate eliminates [A | I] above and below the pivots, which leaves [d*I | d*inverse].
+        Float coefficients are eliminated as exact Fractions and converted back at the end.
+        Returns None if some entry is not a number, Coefficient or BaseCoef,
+        or some coefficient is neither int, Fraction nor float."""
+        from coefficients import Coefficient, BaseCoef, mul_terms, sub_terms, exact_div_terms
+        assert self.is_square, "determinant is only defined for square matrices"
+        if not all(isinstance(x, (Number, Coefficient, BaseCoef)) for x in itt.chain(*self.m)):
+            return None
+        n = self.shape[0]
+        variables = Coefficient.variables_of(itt.chain(*self.m))
+        a = [[Coefficient.to_terms(x, variables) for x in r] for r in self.m]
+        types = {type(c) for r in a for x in r for c in x.values()}
+        if not types <= {int, Fraction, float}:
+            return None
+        out = float if float in types else (lambda c: c)
+        if float in types:
+            a = [[{key: Fraction(c) for key, c in x.items()} for x in r] for r in a]
+        if adjugate:
+            a = [r + [{0: 1} if i == j else {} for j in range(n)] for i, r in enumerate(a)]
+        sign, prev = 1, {0: 1}
+        for k in range(n):
+            p = next((i for i in range(k, n) if a[i][k]), None)
+            if p is None:
+                return 0, None
+            if p != k:
+                a[k], a[p] = a[p], a[k]
+                sign = -sign
+            pivot = a[k]
+            # columns up to k are eliminated and never read again, so only the ones right of the pivot are updated
+            for i in range(n) if adjugate else range(k+1, n):
+                if i == k:
+                    continue
+                r, f = a[i], a[i][k]
+                a[i] = r[:k+1] + [exact_div_terms(sub_terms(mul_terms(pivot[k], x), mul_terms(f, y)), prev)
+                                  if x or (f and y) else {} for x, y in zip(r[k+1:], pivot[k+1:])]
+            prev = pivot[k]
+        det = Coefficient.from_terms({key: out(sign*c) for key, c in prev.items()}, variables)
+        if not adjugate:
+            return det, None
+        adj = Matrix([[Coefficient.from_terms({key: out(sign*c) for key, c in x.items()}, variables) for x in r[n:]] for r in a])
+        return det, adj
+
+    @cached_property
+    def _symbolic_determinant(self):
+        if self.__dict__.get('_symbolic_inverse') is not None:
+            return self._symbolic_inverse[0]
+        ans = self._bareiss(adjugate=False)
+        return self._cofactor_determinant() if ans is None else ans[0]
+
+    @cached_property
+    def _symbolic_inverse(self):
+        ans = self._bareiss(adjugate=True)
+        assert ans is not None, 'symbolic inverse needs number or Coefficient entries with int, Fraction or float coefficients'
+        return ans
+
+    @property
+    def adjugate(self):
+        """Adjugate of a symbolic matrix."""
+        assert self.is_symbolic, 'adjugate is only implemented for Coefficient entries'
+        det, adj = self._symbolic_inverse
+        assert adj is not None, 'adjugate of singular matrix is not implemented'
+        return adj
 
     # @cached_property
     @property
@@ -297,8 +387,13 @@ class Matrix():
     # @cached_property  # requires python 3.8
     @property
     def inverse(self):
-        """Find the inverse of the matrix."""
+        """Find the inverse of the matrix.
+        Symbolic entries can't be divided, so for them this is the pair (adjugate, determinant)."""
         assert self.is_square, 'cannot invert non-square matrix'
+        if self.is_symbolic:
+            det, adj = self._symbolic_inverse
+            assert det != 0, 'cannot invert singular matrix'
+            return adj, det
         assert self.determinant != 0, 'cannot invert singular matrix'
 
         ans = Matrix.identity(self.shape[0])
@@ -356,23 +451,206 @@ class Matrix():
         m.m[j][i] = s
         return m
 
+    def solve_for(self, b):
+        """Return x such that self * x = b.
+        b may be a vector-like or a Matrix whose columns are right hand sides."""
+        if type(b) is Matrix:
+            return self.solve_many(b)
+        return self.solve_many([b])[0]
+
+    def solve_many(self, bs):
+        """Solve self * x = b for every b, reusing one LU factorization of the matrix.
+        bs is a list of vector-likes, or a Matrix whose columns are the right hand sides."""
+        block = type(bs) is Matrix
+        lower, upper, perm = self._lu
+        ans = []
+        for b in bs.cols if block else bs:
+            assert len(b) == len(perm), 'right hand side size does not match'
+            y = [b[p] for p in perm]
+            for i, row in enumerate(lower):
+                y[i] -= sum(a*y[k] for k, a in row)
+            for i in reversed(range(len(y))):
+                pivot, row = upper[i]
+                y[i] = (y[i] - sum(a*y[k] for k, a in row)) / pivot
+            ans.append(y)
+        if block:
+            return Matrix([list(r) for r in zip(*ans)])
+        return [vector(x) for x in ans]
+
+    def apply_many(self, vectors):
+        """self * v for every v at once.
+        vectors is a list of vector-likes, or a Matrix whose columns are the vectors."""
+        block = type(vectors) is Matrix
+        rows, den = self._kernel
+        ans = []
+        for v in vectors.cols if block else vectors:
+            assert len(v) == self.shape[1], 'vector size must be equal to the number of columns'
+            y = [sum(a*v[k] for k, a in r) for r in rows]
+            if den != 1:
+                y = [Fraction(s, den) if type(s) in (int, Fraction) else s / den for s in y]
+            ans.append(y)
+        if block:
+            return Matrix([list(r) for r in zip(*ans)])
+        return [vector(y) for y in ans]
+
+    # both caches assume the matrix is not modified after they are used
+    @cached_property
+    def _kernel(self):
+        """Nonzero entries of every row. Exact matrices are scaled to integers by
+        their common denominator, float matrices are converted to float."""
+        entries = list(itt.chain(*self.m))
+        den = 1
+        if all(type(a) in (int, Fraction) for a in entries):
+            den = math.lcm(*(Fraction(a).denominator for a in entries))
+            convert = lambda a: int(a * den)
+        elif any(type(a) is float for a in entries) and all(type(a) in (int, float) for a in entries):
+            convert = float
+        else:
+            convert = lambda a: a
+        return [[(k, convert(a)) for k, a in enumerate(r) if a != 0] for r in self.m], den
+
+    @cached_property
+    def _lu(self):
+        """PA = LU as the nonzero multipliers of L, the pivots and nonzero entries of U, and P.
+        Exact for int and Fraction entries, partial pivoting for floats."""
+        assert self.is_square, 'can only solve square systems'
+        n = self.shape[0]
+        exact = not any(type(x) is float for x in itt.chain(*self.m))
+        a = [[Fraction(x) if exact else x for x in r] for r in self.m]
+        perm = list(range(n))
+        for c in range(n):
+            if exact:
+                p = next((i for i in range(c, n) if a[i][c] != 0), c)
+            else:
+                p = max(range(c, n), key=lambda i: abs(a[i][c]))
+            assert a[p][c] != 0, 'cannot solve singular system'
+            a[c], a[p] = a[p], a[c]
+            perm[c], perm[p] = perm[p], perm[c]
+            row = [(k, x) for k, x in enumerate(a[c][c+1:], c+1) if x != 0]
+            for i in range(c+1, n):
+                f = a[i][c] / a[c][c]
+                a[i][c] = f
+                if f != 0:
+                    for k, x in row:
+                        a[i][k] -= f * x
+        lower = [[(k, x) for k, x in enumerate(r[:i]) if x != 0] for i, r in enumerate(a)]
+        upper = [(r[i], [(k, x) for k, x in enumerate(r[i+1:], i+1) if x != 0]) for i, r in enumerate(a)]
+        return lower, upper, perm
+
+    @property
+    def lazy(self):
+        """Lazy expression of the matrix, see lazy.py."""
+        from lazy import lazy
+        return lazy(self)
+
     @staticmethod
     def least_squares(A, b):
         """Return best x such that Ax = b."""
-        return (A.T*A)**-1 * A.T*b
+        A = A.lazy
+        return ((A.T*A)**-1 * A.T*b).evaluate()
+
+    def row_reduce(self, trace=False):
+        """Reduced row echelon form, in one pass over the columns.
+        Returns the RREF, the pivot columns and, if trace, the row operations that produced it:
+        ('pivot', i, j) marks the start of a pivot step, ('swap', i, j), ('scale', i, s)
+        and ('add', j, s, i) which adds s times row i to row j.
+        Exact for int and Fraction entries, floats below FLOAT_TOL times the largest entry count as 0."""
+        exact = not any(type(x) is float for x in itt.chain(*self.m))
+        rows = [[Fraction(x) if exact else x for x in r] for r in self.m]
+        tol = 0 if exact else FLOAT_TOL * max(abs(x) for x in itt.chain(*self.m))
+        m, n = self.shape
+        ops, pivots = [], []
+        for c in range(n):
+            r = len(pivots)
+            if r == m:
+                break
+            if exact:
+                p = next((i for i in range(r, m) if rows[i][c] != 0), None)
+            else:
+                p = max(range(r, m), key=lambda i: abs(rows[i][c]))
+                p = p if abs(rows[p][c]) > tol else None
+            if p is None:
+                continue
+            swap = [('pivot', r, c)] + ([('swap', r, p)] if p != r else [])
+            pivot = Matrix._pivot_ops(Matrix._apply_row_ops(rows, swap), r, c)
+            Matrix._apply_row_ops(rows, pivot)
+            if not exact:
+                for i, row in enumerate(rows):
+                    row[c] = int(i == r)
+            if trace:
+                ops += swap + pivot
+            pivots.append(c)
+        return Matrix(rows), pivots, ops if trace else None
+
+    @cached_property
+    def _reduced(self):
+        return self.row_reduce()
 
-    def solve(self, verbose=False):
-        A = self.copy()
-        ans = Matrix.identity(self.shape[0])
+    @property
+    def rref(self):
+        return self._reduced[0].copy()
 
-        for i in range(self.shape[0]):
-            if verbose:
-                print(ans * self)
-                print()
-            op = Matrix.row_echelon_matrix(A, i)
-            ans = op * ans
-            A = op * A
-        return ans * self
+    @property
+    def pivots(self):
+        return self._reduced[1].copy()
+
+    @property
+    def rank(self):
+        return len(self._reduced[1])
+
+    @property
+    def nullspace(self):
+        """A basis of the vectors x such that self * x = 0."""
+        reduced, pivots, _ = self._reduced
+        basis = []
+        for f in range(self.shape[1]):
+            if f in pivots:
+                continue
+            x = [0]*self.shape[1]
+            x[f] = 1
+            for r, c in enumerate(pivots):
+                x[c] = -reduced[r][f]
+            basis.append(vector(x))
+        return basis
+
+    @staticmethod
+    def _pivot_ops(rows, i, j):
+        """Row operations that turn entry i, j into 1 and clear the rest of column j."""
+        p = rows[i][j]
+        assert p != 0, "can't pivot on 0 entry"
+        ops = [] if p == 1 else [('scale', i, Fraction(1, p) if type(p) in (int, Fraction) else 1/p)]
+        return ops + [('add', k, -r[j], i) for k, r in enumerate(rows) if k != i and r[j] != 0]
+
+    @staticmethod
+    def _apply_row_ops(rows, ops):
+        """Apply a trace of row operations in place to a list of rows."""
+        for op in ops:
+            if op[0] == 'swap':
+                _, i, j = op
+                rows[i], rows[j] = rows[j], rows[i]
+            elif op[0] == 'scale':
+                _, i, s = op
+                rows[i] = [x*s for x in rows[i]]
+            elif op[0] == 'add':
+                _, j, s, i = op
+                rows[j] = [x + s*y for x, y in zip(rows[j], rows[i])]
+        return rows
+
+    @staticmethod
+    def replay(A, ops):
+        """Apply a trace of row operations to A without building any operation matrix."""
+        return Matrix(Matrix._apply_row_ops([list(r) for r in A.rows], ops))
+
+    def solve(self, verbose=False):
+        reduced, _, ops = self.row_reduce(trace=verbose)
+        if verbose:
+            rows = [list(r) for r in self.m]
+            for op in ops:
+                if op[0] == 'pivot':
+                    print(Matrix(rows))
+                    print()
+                Matrix._apply_row_ops(rows, [op])
+        return reduced
 
     def interactive_pivot(self):
         i = 0
@@ -385,13 +663,15 @@ class Matrix():
             m = Matrix.pivot_matrix(m * self, i, j) * m
 
     @staticmethod
-    def interactive_manipulation(A):
-        act = 0
+    def interactive_manipulation(A, trace=None):
+        """Manipulate the rows of A by hand, starting from an optional trace of row operations.
+        Returns the matrix of all the operations applied."""
         n = A.shape[0]
-        m = Matrix.identity(n)
-        undo = Matrix.identity(n)
+        ops = list(trace or [])
+        rows = Matrix._apply_row_ops([list(r) for r in A.rows], ops)
+        undo = (rows, ops)
         while True:
-            print(m * A)
+            print(Matrix(rows))
             print()
             act = input(
                 "Select action: 0:scale, 1:swap, 2:add, 3:pivot, 4:undo, -1:exit")
@@ -407,8 +687,7 @@ class Matrix():
                     sc = float(sc)
                 else:
                     sc = int(sc)
-                undo = m
-                m = Matrix._scale_row_matrix(n, sc, int(i)) * m
+                new = [('scale', int(i), sc)]
                 print(f'Scaled row {i} by {sc}')
             elif act in ['1', 'swap']:
                 try:
@@ -417,8 +696,7 @@ class Matrix():
                 except:
                     print('invalid input!')
                     continue
-                undo = m
-                m = Matrix._swap_rows_matrix(n, i, j) * m
+                new = [('swap', i, j)]
                 print(f'Swapped rows {i} and {j}')
             elif act in ['2', 'add']:
                 try:
@@ -427,13 +705,12 @@ class Matrix():
                     print('invalid input!')
                     continue
                 if '/' in sc:
-                    sc = Fraction(*(int(x) for x in sc.split('/'))) * m
+                    sc = Fraction(*(int(x) for x in sc.split('/')))
                 elif '.' in sc:
                     sc = float(sc)
                 else:
                     sc = int(sc)
-                undo = m
-                m = Matrix._add_scaled_row_matrix(n, sc, int(i), int(j)) * m
+                new = [('add', int(j), sc, int(i))]
                 print(f'To row {j} added {sc} times row {i}')
             elif act in ['3', 'pivot']:
                 try:
@@ -442,14 +719,18 @@ class Matrix():
                 except:
                     print('invalid input!')
                     continue
-                undo = m
-                m = Matrix.pivot_matrix(m * A, i, j) * m
+                new = [('pivot', i, j)] + Matrix._pivot_ops(rows, i, j)
                 print(f'Pivoted on entry {i} {j}')
-            elif act in ['4', 'pivot']:
-                m = undo
+            elif act in ['4', 'undo']:
+                rows, ops = undo
                 print('Undid last action')
-            elif act in ['-1', 'undo']:
+                continue
+            elif act in ['-1', 'exit']:
                 break
             else:
                 print('Invalid action')
-        return m
+                continue
+            undo = (rows, ops)
+            rows = Matrix._apply_row_ops(list(rows), new)
+            ops = ops + new
+        return Matrix.replay(Matrix.identity(n), ops)